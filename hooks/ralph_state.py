@@ -0,0 +1,18 @@
+"""
+Ralph Wiggum state file - shared by the stop hook modules
+Kept free of heavy imports so the entry point can load it on every Stop event
+"""
+
+import os
+
+STATE_PATH = ".claude/ralph-loop.local.md"
+
+# Smallest file that can hold "---\n<field>\n---"
+MIN_STATE_SIZE = 8
+
+
+def remove_state_file():
+    try:
+        os.remove(STATE_PATH)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Ralph Wiggum Stop Hook - Cross-platform Python version
+Prevents session exit when a ralph-loop is active
+Feeds Claude's output back as input to continue the loop
+
+Loaded by stop-hook.py, either in-process or inside stop_hook_daemon.py
+"""
+
+import json
+import os
+import re
+import sys
+import time
+
+from ralph_state import STATE_PATH, remove_state_file
+
+# orjson is optional; its JSONDecodeError subclasses json.JSONDecodeError
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+except ImportError:
+    _json_loads = json.loads
+
+    def _json_dumps(obj):
+        return json.dumps(obj).encode("utf-8")
+
+# Patterns are compiled once at import; the hook runs on every Stop event.
+# The state file is scanned as bytes and only the captured spans are decoded.
+_FRONTMATTER_RE = re.compile(rb"---\r?\n(.+?)\r?\n---(?:\r?\n|\Z)", re.DOTALL)
+_FIELDS_RE = re.compile(
+    rb"^[ \t]*(?:"
+    rb"(?i:active):[ \t]*(?P<active>\w+)"
+    rb"|iteration:[ \t]*(?P<iter>\d+)"
+    rb"|max_iterations:[ \t]*(?P<max>\d+)"
+    rb'|completion_promise:[ \t]*"?(?P<cp>[^"\r\n]*)"?'
+    rb")",
+    re.MULTILINE,
+)
+
+# Frontmatter must close within the first 8 KiB of the state file; this
+# bounds the regex on files that never close it
+_FRONTMATTER_MAX_SIZE = 8 * 1024
+
+# Windows refuses os.replace() while another process has the state file open
+_REPLACE_ATTEMPTS = 5
+_REPLACE_RETRY_SECONDS = 0.05
+
+# Transcripts grow with every turn, so they are read backwards in chunks
+_ASSISTANT_MARKER = b'"role":"assistant"'
+_TAIL_CHUNK_SIZE = 64 * 1024
+
+
+def _last_assistant_line(path):
+    """Return the last JSONL line mentioning an assistant message, or None.
+
+    Scans the file backwards so only the tail of a long transcript is read.
+    """
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        # Pieces of the line straddling chunk boundaries, newest first
+        partial = []
+        while pos > 0:
+            size = min(_TAIL_CHUNK_SIZE, pos)
+            pos -= size
+            f.seek(pos)
+            chunk = f.read(size)
+            partial.append(chunk)
+            # Text before the first newline may continue into earlier chunks
+            first_newline = chunk.find(b"\n") if pos else -1
+            if pos and first_newline == -1:
+                continue
+            buf = b"".join(reversed(partial))
+            marker = buf.rfind(_ASSISTANT_MARKER, first_newline + 1)
+            if marker != -1:
+                start = buf.rfind(b"\n", 0, marker) + 1
+                end = buf.find(b"\n", marker)
+                return buf[start:] if end == -1 else buf[start:end]
+            partial = [buf[:first_newline]]
+    return None
+
+
+def _write_state_file(content):
+    """Replace the state file with content, atomically where possible.
+
+    Writes to a sibling temp file and swaps it in, so a crash mid-write cannot
+    leave a truncated state file. If the swap keeps failing because the file is
+    held open elsewhere, the new content is written in place instead.
+    """
+    tmp_state_path = STATE_PATH + ".tmp"
+    try:
+        with open(tmp_state_path, "wb") as f:
+            f.write(content)
+        for _ in range(_REPLACE_ATTEMPTS):
+            try:
+                os.replace(tmp_state_path, STATE_PATH)
+                return
+            except PermissionError:
+                time.sleep(_REPLACE_RETRY_SECONDS)
+        with open(STATE_PATH, "wb") as f:
+            f.write(content)
+    finally:
+        try:
+            os.remove(tmp_state_path)
+        except FileNotFoundError:
+            pass
+
+
+def run(hook_input_raw):
+    """Handle one Stop event given the raw hook input bytes. Always exits."""
+    try:
+        # Check if ralph-loop is active
+        if not os.path.exists(STATE_PATH):
+            # No active loop - allow exit
+            sys.exit(0)
+
+        # Read state file
+        with open(STATE_PATH, "rb") as f:
+            content = f.read()
+        if not content:
+            sys.exit(0)
+
+        # Parse markdown frontmatter (YAML between ---); the prompt follows it.
+        # Files that do not open with a --- line are rejected without the regex.
+        frontmatter_match = None
+        if content.startswith((b"---\n", b"---\r")):
+            # Leave room past the 8 KiB bound for the closing line's \r\n
+            frontmatter_match = _FRONTMATTER_RE.match(content, 0, _FRONTMATTER_MAX_SIZE + 2)
+            # \Z also matches at that bound, where the --- line may go on
+            if (
+                frontmatter_match
+                and frontmatter_match.end() < len(content)
+                and not content.endswith(b"\n", 0, frontmatter_match.end())
+            ):
+                frontmatter_match = None
+        if not frontmatter_match:
+            print("Warning: Ralph loop: Failed to parse frontmatter", file=sys.stderr)
+            remove_state_file()
+            sys.exit(0)
+
+        frontmatter_start, frontmatter_end = frontmatter_match.span(1)
+        prompt_text = content[frontmatter_match.end():].decode("utf-8").strip().replace("\r\n", "\n")
+
+        # Extract values from frontmatter
+        iteration = 0
+        max_iterations = 0
+        completion_promise = None
+        iteration_span = None
+        active = True
+
+        for match in _FIELDS_RE.finditer(content, frontmatter_start, frontmatter_end):
+            if match.lastgroup == "active":
+                active = match.group("active").lower() not in (b"false", b"no")
+            elif match.lastgroup == "iter":
+                iteration = int(match.group("iter"))
+                iteration_span = match.span("iter")
+            elif match.lastgroup == "max":
+                max_iterations = int(match.group("max"))
+            else:
+                completion_promise = match.group("cp").decode("utf-8").rstrip()
+                if completion_promise in ("null", ""):
+                    completion_promise = None
+
+        # Check if loop is active
+        if not active:
+            # Loop is inactive - allow exit
+            sys.exit(0)
+
+        # Validate numeric fields
+        if iteration <= 0:
+            sys.stderr.write(
+                "Warning: Ralph loop: State file corrupted\n"
+                f"   File: {STATE_PATH}\n"
+                "   Problem: 'iteration' field is not a valid number\n"
+                "\n"
+                "   This usually means the state file was manually edited or corrupted.\n"
+                "   Ralph loop is stopping. Run /ralph-loop again to start fresh.\n"
+            )
+            remove_state_file()
+            sys.exit(0)
+
+        # Check if max iterations reached
+        if max_iterations > 0 and iteration >= max_iterations:
+            print(f"Stop: Ralph loop: Max iterations ({max_iterations}) reached.")
+            remove_state_file()
+            sys.exit(0)
+
+        # Parse hook input JSON
+        hook_input = None
+        if hook_input_raw.strip():
+            try:
+                hook_input = _json_loads(hook_input_raw)
+            except json.JSONDecodeError:
+                print("Warning: Ralph loop: Failed to parse hook input JSON", file=sys.stderr)
+                remove_state_file()
+                sys.exit(0)
+
+        if not hook_input:
+            print("Warning: Ralph loop: No hook input received", file=sys.stderr)
+            remove_state_file()
+            sys.exit(0)
+
+        transcript_path = hook_input.get("transcript_path")
+
+        if not transcript_path or not os.path.exists(transcript_path):
+            sys.stderr.write(
+                "Warning: Ralph loop: Transcript file not found\n"
+                f"   Expected: {transcript_path}\n"
+                "   This is unusual and may indicate a Claude Code internal issue.\n"
+                "   Ralph loop is stopping.\n"
+            )
+            remove_state_file()
+            sys.exit(0)
+
+        # Find last assistant message in the transcript (JSONL format)
+        last_line = _last_assistant_line(transcript_path)
+
+        if last_line is None:
+            sys.stderr.write(
+                "Warning: Ralph loop: No assistant messages found in transcript\n"
+                f"   Transcript: {transcript_path}\n"
+                "   This is unusual and may indicate a transcript format issue\n"
+                "   Ralph loop is stopping.\n"
+            )
+            remove_state_file()
+            sys.exit(0)
+
+        # Check for completion promise (only if set). The assistant message is
+        # only decoded here; without a promise just its presence matters.
+        if completion_promise:
+            last_output = ""
+            try:
+                last_message = _json_loads(last_line)
+                text_content = [
+                    item.get("text", "")
+                    for item in last_message.get("message", {}).get("content", [])
+                    if item.get("type") == "text"
+                ]
+                last_output = "\n".join(text_content)
+            except (UnicodeDecodeError, json.JSONDecodeError, KeyError, TypeError) as e:
+                sys.stderr.write(
+                    "Warning: Ralph loop: Failed to parse assistant message JSON\n"
+                    f"   Error: {e}\n"
+                    "   This may indicate a transcript format issue\n"
+                    "   Ralph loop is stopping.\n"
+                )
+                remove_state_file()
+                sys.exit(0)
+
+            if not last_output:
+                sys.stderr.write(
+                    "Warning: Ralph loop: Assistant message contained no text content\n"
+                    "   Ralph loop is stopping.\n"
+                )
+                remove_state_file()
+                sys.exit(0)
+
+            # First <promise>...</promise> pair, found with plain string search
+            start = last_output.find("<promise>")
+            end = last_output.find("</promise>", start) if start != -1 else -1
+            if end != -1:
+                promise_text = " ".join(last_output[start + len("<promise>"):end].split())
+                if promise_text == completion_promise:
+                    print(f"Done: Ralph loop: Detected <promise>{completion_promise}</promise>")
+                    remove_state_file()
+                    sys.exit(0)
+
+        # Not complete - continue loop with SAME PROMPT
+        next_iteration = iteration + 1
+
+        if not prompt_text:
+            sys.stderr.write(
+                "Warning: Ralph loop: State file corrupted or incomplete\n"
+                f"   File: {STATE_PATH}\n"
+                "   Problem: No prompt text found\n"
+                "\n"
+                "   This usually means:\n"
+                "     - State file was manually edited\n"
+                "     - File was corrupted during writing\n"
+                "\n"
+                "   Ralph loop is stopping. Run /ralph-loop again to start fresh.\n"
+            )
+            remove_state_file()
+            sys.exit(0)
+
+        # Update iteration in state file by splicing the value parsed above
+        iteration_start, iteration_end = iteration_span
+        new_content = content[:iteration_start] + b"%d" % next_iteration + content[iteration_end:]
+        _write_state_file(new_content)
+
+        # Build system message with iteration count and completion promise info
+        if completion_promise:
+            system_msg = f"Refresh: Ralph iteration {next_iteration} | To stop: output <promise>{completion_promise}</promise> (ONLY when statement is TRUE - do not lie to exit!)"
+        else:
+            system_msg = f"Refresh: Ralph iteration {next_iteration} | No completion promise set - loop runs infinitely"
+
+        # Output JSON to block the stop and feed prompt back. The object shape
+        # is fixed, so only the two string values go through the encoder.
+        output = bytearray(b'{"decision":"block","reason":')
+        output += _json_dumps(prompt_text)
+        output += b',"systemMessage":'
+        output += _json_dumps(system_msg)
+        output += b"}\n"
+
+        sys.stdout.buffer.write(output)
+        sys.exit(0)
+
+    except Exception as e:
+        # Global error handler - log error and allow exit to prevent crash
+        sys.stderr.write(
+            "Error: Ralph loop: Unexpected error occurred\n"
+            f"   Error: {e}\n"
+            "   Ralph loop is stopping to prevent crash.\n"
+        )
+
+        # Try to clean up state file
+        try:
+            remove_state_file()
+        except Exception:
+            pass
+
+        sys.exit(0)
+
+
+def main():
+    # Read hook input from stdin
+    run(sys.stdin.buffer.read())
+
+
+if __name__ == "__main__":
+    main()
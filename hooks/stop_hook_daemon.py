@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Ralph Wiggum Stop Hook Daemon - keeps ralph_stop loaded between Stop events
+Listens on a unix socket in .claude/ while a ralph-loop is active, so each
+hook invocation skips interpreter startup and module imports
+Exits once the loop's state file is gone or after a long idle period
+"""
+
+import os
+import sys
+
+# The client side only needs the C module; socket.py pulls in enum/selectors
+import _socket
+
+from ralph_state import STATE_PATH
+
+SOCKET_PATH = ".claude/stop-hook.sock"
+
+# How often the daemon re-checks the state file, and how long it may sit idle
+_POLL_SECONDS = 5
+_IDLE_SECONDS = 30 * 60
+
+# A daemon that accepted a request but never answers must not hang the hook,
+# and a client that connects but never sends must not hold up the daemon
+_REPLY_TIMEOUT_SECONDS = 30
+_REQUEST_TIMEOUT_SECONDS = 2
+
+# Requests are "<magic> <input length> <code version>\n" + hook input; anything
+# else (e.g. a bare connect used as a liveness probe) is dropped without
+# running the hook
+_REQUEST_MAGIC = b"RALPH1"
+_MAX_HEADER_SIZE = 4096
+
+# Sent instead of a reply when the request came from another plugin install;
+# the hook was not run, so the client runs it itself
+_STALE_REPLY = b"stale\n"
+
+
+def _code_version():
+    """Identify the ralph_stop.py this module was loaded alongside."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ralph_stop.py")
+    return b"%s:%d" % (os.fsencode(path), os.stat(path).st_mtime_ns)
+
+
+def request(hook_input_raw):
+    """Send hook input to a running daemon.
+
+    Returns (stdout, stderr) bytes, or None if no daemon took the request (or
+    it belongs to another plugin install), in which case the caller runs the
+    hook itself. Once the request is sent the
+    daemon may run the hook, so a missing or malformed reply raises instead.
+    """
+    sock = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(SOCKET_PATH)
+            sock.settimeout(_REPLY_TIMEOUT_SECONDS)
+            header = b"%s %d %s\n" % (_REQUEST_MAGIC, len(hook_input_raw), _code_version())
+            sock.sendall(header + hook_input_raw)
+        except OSError:
+            # The daemon never saw a complete request, so it did not run the hook
+            return None
+        chunks = []
+        while chunk := sock.recv(65536):
+            chunks.append(chunk)
+        reply = b"".join(chunks)
+    finally:
+        sock.close()
+
+    if reply == _STALE_REPLY:
+        return None
+
+    # Reply is "<stdout length>\n" followed by stdout then stderr
+    header, sep, body = reply.partition(b"\n")
+    if not sep:
+        raise ValueError("no reply from stop hook daemon")
+    stdout_len = int(header)
+    if stdout_len > len(body):
+        raise ValueError("truncated reply from stop hook daemon")
+    return body[:stdout_len], body[stdout_len:]
+
+
+def spawn():
+    """Start a detached daemon for the current directory."""
+    import subprocess
+
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__)],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def _read_request(conn):
+    """Return (hook input, code version) from a framed request, or None if malformed."""
+    data = b""
+    while b"\n" not in data:
+        chunk = conn.recv(4096)
+        if not chunk or len(data) > _MAX_HEADER_SIZE:
+            return None
+        data += chunk
+    header, _, hook_input_raw = data.partition(b"\n")
+    fields = header.split(b" ", 2)
+    if len(fields) != 3 or fields[0] != _REQUEST_MAGIC or not fields[1].isdigit():
+        return None
+    length, version = fields[1:]
+
+    # Read exactly the announced length; the client does not close its side
+    length = int(length)
+    chunks = [hook_input_raw]
+    received = len(hook_input_raw)
+    while received < length:
+        chunk = conn.recv(min(65536, length - received))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        received += len(chunk)
+    if received != length:
+        return None
+    return b"".join(chunks), version
+
+
+def _handle(conn, ralph_stop, version):
+    """Run one request and reply to it.
+
+    Returns False without replying if the request came from another plugin
+    install, whose ralph_stop may differ from the one loaded here.
+    """
+    import io
+    from contextlib import redirect_stderr, redirect_stdout
+
+    request = _read_request(conn)
+    if request is None:
+        return True
+    hook_input_raw, client_version = request
+    if client_version != version:
+        return False
+
+    stdout, stderr = io.BytesIO(), io.BytesIO()
+    stdout_text = io.TextIOWrapper(stdout, encoding="utf-8", write_through=True)
+    stderr_text = io.TextIOWrapper(stderr, encoding="utf-8", write_through=True)
+    with redirect_stdout(stdout_text), redirect_stderr(stderr_text):
+        try:
+            ralph_stop.run(hook_input_raw)
+        except SystemExit:
+            pass
+
+    out = stdout.getvalue()
+    conn.settimeout(_REPLY_TIMEOUT_SECONDS)
+    conn.sendall(b"%d\n" % len(out) + out + stderr.getvalue())
+    return True
+
+
+def serve():
+    import errno
+    import socket
+    import time
+
+    import ralph_stop
+
+    version = _code_version()
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with server:
+        try:
+            server.bind(SOCKET_PATH)
+        except OSError as e:
+            if e.errno != errno.EADDRINUSE:
+                raise
+            # Another daemon already owns the socket - nothing to do. The
+            # probe sends no request, so the live daemon ignores it.
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            with probe:
+                try:
+                    probe.connect(SOCKET_PATH)
+                    return
+                except ConnectionRefusedError:
+                    pass
+            # Left behind by a daemon that died - take it over
+            os.remove(SOCKET_PATH)
+            server.bind(SOCKET_PATH)
+        os.chmod(SOCKET_PATH, 0o600)
+        server.listen()
+        server.settimeout(_POLL_SECONDS)
+
+        last_request = time.monotonic()
+        stale_conn = None
+        try:
+            while os.path.exists(STATE_PATH):
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    if time.monotonic() - last_request > _IDLE_SECONDS:
+                        break
+                    continue
+                conn.settimeout(_REQUEST_TIMEOUT_SECONDS)
+                try:
+                    if not _handle(conn, ralph_stop, version):
+                        stale_conn = conn
+                        break
+                except OSError:
+                    pass
+                conn.close()
+                last_request = time.monotonic()
+        finally:
+            try:
+                os.remove(SOCKET_PATH)
+            except FileNotFoundError:
+                pass
+
+        # The plugin was updated under us: step aside only once the socket
+        # path is free, so the daemon the client spawns next can bind it
+        if stale_conn is not None:
+            with stale_conn:
+                try:
+                    stale_conn.sendall(_STALE_REPLY)
+                except OSError:
+                    pass
+
+        # Answer clients that connected before the socket path was removed
+        server.setblocking(False)
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                break
+            conn.settimeout(_REQUEST_TIMEOUT_SECONDS)
+            with conn:
+                try:
+                    if not _handle(conn, ralph_stop, version):
+                        conn.sendall(_STALE_REPLY)
+                except OSError:
+                    pass
+
+
+if __name__ == "__main__":
+    serve()